@@ -1,11 +1,11 @@
-import time, json, argparse, os, psutil, gc
+import time, json, argparse, os, psutil, gc, tracemalloc
+import multiprocessing, queue, shutil, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import numpy as np
+import orjson
 from rust_annie import AnnIndex, Distance
-from datetime import datetime
-from sklearn.neighbors import NearestNeighbors
 from typing import Dict, Any, Literal
-import faiss
-import annoy
 
 # Standardized datasets
 DATASETS = {
@@ -14,51 +14,122 @@ DATASETS = {
     "large": {"N": 1_000_000, "D": 256, "k": 50},
 }
 
-import os
-import psutil
+# Queries per timed search call; per-query latency is derived from each shard
+SEARCH_SHARD = 32
+# Fewest timed shards per run, so search_p99 is not just the slowest of a
+# handful of samples
+MIN_SEARCH_SHARDS = 200
+
+# Reused by measure_memory() instead of creating a new handle on every call
+_PROC = psutil.Process(os.getpid())
 
 
 def measure_memory() -> float:
     """
-    Measures the current process's memory usage in megabytes.
+    Measures the memory private to this process (USS) in megabytes.
+    Unlike RSS this excludes shared pages such as BLAS libraries, so deltas
+    reflect what the index itself allocated. Reading USS walks
+    /proc/self/smaps on Linux, so call it around builds, not in query loops.
     Returns:
         float: Memory usage in MB.
     """
-    process = psutil.Process(os.getpid())
-    return process.memory_info().rss / (1024**2)  # MB
+    return _PROC.memory_full_info().uss / (1024**2)  # MB
 
 
-def benchmark(
-    dataset: Literal["small","medium","large"] = "medium", repeats: int = 50, batch_size: int = 10000
-) -> Dict[str, Any]:
+def stabilize_process(pin_cpu: bool = False) -> None:
     """
-    Runs benchmarks on multiple ANN libraries using synthetic datasets.
+    Reduces scheduler noise before timing. Raises the process priority when
+    permitted and optionally pins the process to CPU 0. Pinning also confines
+    rayon/OpenMP worker threads to that core, so it is opt-in.
     Args:
-        dataset (str): Dataset size category - small, medium or large.
-        repeats (int): Number of query repetitions.
-        batch_size (int): Number of rows to process at a time to reduce memory usage.
+        pin_cpu (bool): Restrict the process to a single core (Linux only).
+    """
+    try:
+        _PROC.nice(-10)
+    except (psutil.AccessDenied, OSError):
+        pass  # unprivileged runners keep the default priority
+    if pin_cpu and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {0})
+
+
+@contextmanager
+def track_python_memory():
+    """
+    Traces Python-level allocations (including NumPy buffers) for the
+    duration of the block. Native allocations made by C/C++/Rust libraries
+    are invisible to tracemalloc, so only use this for pure NumPy/Python
+    builders and keep measure_memory() for the rest.
+    Yields:
+        Callable[[], float]: Returns the peak traced allocation in MB so far.
+    """
+    tracemalloc.start()
+    try:
+        yield lambda: tracemalloc.get_traced_memory()[1] / (1024**2)
+    finally:
+        tracemalloc.stop()
+
+
+def alloc_random(rng: np.random.Generator, shape) -> np.ndarray:
+    """
+    Allocates a C-contiguous float32 array and fills it in place with
+    unit-normalized Gaussian rows. Unlike uniform [0, 1) data these spread
+    over the sphere like real embeddings, so distance distributions (and
+    pruning behaviour) resemble production workloads.
+    Args:
+        rng (np.random.Generator): Source of the Gaussian samples.
+        shape (Tuple[int, int]): Array shape.
     Returns:
-        Dict[str, Any]: Benchmark results including memory usage and timing stats.
+        np.ndarray: The filled array.
     """
-    config = DATASETS[dataset]
-    N, D, k = config["N"], config["D"], config["k"]
+    buf = np.empty(shape, dtype=np.float32)
+    rng.standard_normal(out=buf, dtype=np.float32)
+    # Row norms via einsum avoid the full-size temporary np.linalg.norm creates
+    buf /= np.sqrt(np.einsum("ij,ij->i", buf, buf))[:, None]
+    return buf
 
-    data = np.ascontiguousarray(np.random.rand(N, D).astype(np.float32))
-    ids = np.ascontiguousarray(np.arange(N, dtype=np.int64))
-    queries = np.random.rand(batch_size, D).astype(np.float32)
 
-    results = {
-        "timestamp": datetime.utcnow().timestamp(),
-        "dataset": dataset,
-        "config": config,
-        "repeats": repeats,
-        "rust_annie": {},
-        "sklearn": {},
-        "faiss": {},
-        "annoy": {},
-    }
+def load_shared(path: str) -> np.ndarray:
+    """
+    Copies an array saved by the parent process into private memory.
+    Args:
+        path (str): `.npy` file written with np.save.
+    Returns:
+        np.ndarray: A C-contiguous, writable copy of the array.
+    """
+    return np.array(np.load(path, mmap_mode="r"))
+
 
-    # Rust benchmark
+def time_search(search_fn, queries, shard: int = SEARCH_SHARD, warmup: int = 3):
+    """
+    Times a batched search over consecutive shards of the query set.
+    Args:
+        search_fn (callable): Runs a search for a block of query rows.
+        queries (Sequence): Sliceable sequence of n query rows, e.g. an
+            (n, D) ndarray or a list of lists.
+        shard (int): Number of queries per timed call.
+        warmup (int): Untimed calls on the first shard before measuring.
+    Returns:
+        Tuple[float, np.ndarray]: Average per-query time over all queries and
+            the per-query time of each shard, both in seconds.
+    """
+    for _ in range(warmup):
+        search_fn(queries[:shard])
+
+    # Integer nanoseconds keep full resolution; convert to seconds once at the end
+    starts = np.arange(0, len(queries), shard)
+    sizes = np.minimum(shard, len(queries) - starts)
+    elapsed_ns = np.empty(len(starts), dtype=np.int64)
+    for i, start in enumerate(starts):
+        block = queries[start:start + shard]
+        t0 = time.perf_counter_ns()
+        search_fn(block)
+        elapsed_ns[i] = time.perf_counter_ns() - t0
+    per_query = elapsed_ns.astype(np.float64) / sizes * 1e-9
+    return int(elapsed_ns.sum()) / len(queries) * 1e-9, per_query
+
+
+def bench_rust_annie(data, ids, queries, k, batch_size) -> Dict[str, Any]:
+    N, D = data.shape
     gc.collect()
     mem_before = measure_memory()
     build_start = time.perf_counter()
@@ -79,98 +150,241 @@ def benchmark(
     build_time = time.perf_counter() - build_start
     mem_after = measure_memory()
 
-    search_times = []
-    for q in queries:
-        start = time.perf_counter()
-        idx.search(q, k, None)
-        search_times.append(time.perf_counter() - start)
+    search_avg, search_times = time_search(
+        lambda block: idx.search_batch(block, k, None), queries
+    )
+    # One partition pass for all three percentiles
+    p50, p95, p99 = np.quantile(search_times, [0.5, 0.95, 0.99])
+
+    return {
+        "build_time": build_time,
+        "build_memory_mb": mem_after - mem_before,
+        "search_times": search_times.tolist(),
+        "search_avg": search_avg,
+        "search_p50": p50,
+        "search_p95": p95,
+        "search_p99": p99,
+    }
+
+
+def bench_sklearn(data, ids, queries, k, batch_size) -> Dict[str, Any]:
+    from sklearn.neighbors import NearestNeighbors
+
+    gc.collect()
+    mem_before = measure_memory()
+    build_start = time.perf_counter()
+    nn = NearestNeighbors(n_neighbors=k, algorithm="brute")
+    nn.fit(data)
+    build_time = time.perf_counter() - build_start
+    mem_after = measure_memory()
+
+    # sklearn's brute-force index is plain NumPy, so tracemalloc sees all of
+    # it. Trace a separate, untimed fit so the overhead stays out of build_time;
+    # the peak is its own metric, not comparable with the USS deltas.
+    with track_python_memory() as peak_mb:
+        NearestNeighbors(n_neighbors=k, algorithm="brute").fit(data)
+        python_peak_mb = peak_mb()
+
+    search_avg, search_times = time_search(
+        lambda block: nn.kneighbors(block, return_distance=False), queries
+    )
 
-    results["rust_annie"] = {
+    return {
         "build_time": build_time,
         "build_memory_mb": mem_after - mem_before,
-        "search_times": search_times,
-        "search_avg": np.mean(search_times),
+        "build_python_peak_mb": python_peak_mb,
+        "search_avg": search_avg,
         "search_p50": np.percentile(search_times, 50),
-        "search_p95": np.percentile(search_times, 95),
-        "search_p99": np.percentile(search_times, 99),
     }
 
-    # Scikit-learn benchmark
-    try:
-        gc.collect()
-        mem_before = measure_memory()
-        build_start = time.perf_counter()
-        nn = NearestNeighbors(n_neighbors=k, algorithm="brute")
-        nn.fit(data)
-        build_time = time.perf_counter() - build_start
-        mem_after = measure_memory()
-
-        search_times = []
-        for q in queries:
-            start = time.perf_counter()
-            nn.kneighbors(q.reshape(1, -1), return_distance=False)
-            search_times.append(time.perf_counter() - start)
-
-        results["sklearn"] = {
-            "build_time": build_time,
-            "build_memory_mb": mem_after - mem_before,
-            "search_avg": np.mean(search_times),
-            "search_p50": np.percentile(search_times, 50),
-        }
-    except ImportError:
-        pass
 
-    # FAISS benchmark
+def bench_faiss(data, ids, queries, k, batch_size) -> Dict[str, Any]:
+    import faiss
+
+    D = data.shape[1]
+    gc.collect()
+    mem_before = measure_memory()
+    build_start = time.perf_counter()
+    index = faiss.IndexFlatL2(D)
+    index.add(data)
+    build_time = time.perf_counter() - build_start
+    mem_after = measure_memory()
+
+    search_avg, search_times = time_search(
+        lambda block: index.search(block, k), queries
+    )
+
+    return {
+        "build_time": build_time,
+        "build_memory_mb": mem_after - mem_before,
+        "search_avg": search_avg,
+        "search_p50": np.percentile(search_times, 50),
+    }
+
+
+def bench_annoy(data, ids, queries, k, batch_size) -> Dict[str, Any]:
+    import annoy
+
+    N, D = data.shape
+    gc.collect()
+    mem_before = measure_memory()
+    build_start = time.perf_counter()
+    t = annoy.AnnoyIndex(D, "euclidean")
+    # Annoy reads each vector element by element; plain Python floats are
+    # much cheaper for it to convert than NumPy scalars. Convert a whole
+    # slice at a time so no per-row ndarray view is created either.
+    # Item ids come from the shared `ids` array (0..N-1) like the other libraries
+    for start in range(0, N, batch_size):
+        end = start + batch_size
+        for i, row in zip(ids[start:end].tolist(), data[start:end].tolist()):
+            t.add_item(i, row)
+    t.build(10)
+    build_time = time.perf_counter() - build_start
+    mem_after = measure_memory()
+
+    # Annoy has no batch API, so each shard is still searched row by row.
+    # Hand it Python lists converted up front, outside the timed region, for
+    # the same reason as in the build loop above.
+    search_avg, search_times = time_search(
+        lambda block: [t.get_nns_by_vector(q, k) for q in block], queries.tolist()
+    )
+
+    return {
+        "build_time": build_time,
+        "build_memory_mb": mem_after - mem_before,
+        "search_avg": search_avg,
+        "search_p50": np.percentile(search_times, 50),
+    }
+
+
+# Library name -> benchmark function; each runs in its own worker process
+BENCHMARKS = {
+    "rust_annie": bench_rust_annie,
+    "sklearn": bench_sklearn,
+    "faiss": bench_faiss,
+    "annoy": bench_annoy,
+}
+
+
+def _bench_worker(bench_fn, paths, k, batch_size, results_queue):
     try:
-        gc.collect()
-        mem_before = measure_memory()
-        build_start = time.perf_counter()
-        index = faiss.IndexFlatL2(D)
-        index.add(data)
-        build_time = time.perf_counter() - build_start
-        mem_after = measure_memory()
-
-        search_times = []
-        for q in queries:
-            start = time.perf_counter()
-            _, _ = index.search(q.reshape(1, -1), k)
-            search_times.append(time.perf_counter() - start)
-
-        results["faiss"] = {
-            "build_time": build_time,
-            "build_memory_mb": mem_after - mem_before,
-            "search_avg": np.mean(search_times),
-            "search_p50": np.percentile(search_times, 50),
-        }
+        data, ids, queries = (load_shared(path) for path in paths)
+        # Floating-point warnings would only format messages inside timed code
+        with np.errstate(all="ignore"):
+            result = bench_fn(data, ids, queries, k, batch_size)
+        results_queue.put((result, None))
     except ImportError:
-        pass
+        # Optional library is not installed; report an empty result
+        results_queue.put(({}, None))
+    except Exception as e:
+        results_queue.put((None, f"{type(e).__name__}: {e}"))
+
 
-    # Annoy benchmark
+def run_isolated(bench_fn, paths, k: int, batch_size: int) -> Dict[str, Any]:
+    """
+    Runs one library's benchmark in a freshly spawned interpreter so its
+    build_memory_mb is not polluted by allocations left behind by the others.
+    Args:
+        bench_fn (callable): Module-level bench_* function to run.
+        paths (Tuple[str, str, str]): `.npy` files holding data, ids and queries.
+        k (int): Number of neighbours per query.
+        batch_size (int): Number of rows to process at a time.
+    Returns:
+        Dict[str, Any]: The library's result dict, empty if it is not installed.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results_queue = ctx.Queue()
+    proc = ctx.Process(
+        target=_bench_worker, args=(bench_fn, paths, k, batch_size, results_queue)
+    )
+    proc.start()
     try:
-        gc.collect()
-        mem_before = measure_memory()
-        build_start = time.perf_counter()
-        t = annoy.AnnoyIndex(D, "euclidean")
-        for i in range(N):
-            t.add_item(i, data[i])
-        t.build(10)
-        build_time = time.perf_counter() - build_start
-        mem_after = measure_memory()
-
-        search_times = []
-        for q in queries:
-            start = time.perf_counter()
-            t.get_nns_by_vector(q, k)
-            search_times.append(time.perf_counter() - start)
-
-        results["annoy"] = {
-            "build_time": build_time,
-            "build_memory_mb": mem_after - mem_before,
-            "search_avg": np.mean(search_times),
-            "search_p50": np.percentile(search_times, 50),
-        }
-    except ImportError:
-        pass
+        while True:
+            try:
+                result, error = results_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not proc.is_alive():
+                    raise RuntimeError(
+                        f"{bench_fn.__name__} exited with code {proc.exitcode}"
+                    )
+    finally:
+        proc.join()
+    if error is not None:
+        raise RuntimeError(f"{bench_fn.__name__} failed: {error}")
+    return result
+
+
+def benchmark(
+    dataset: Literal["small","medium","large"] = "medium",
+    repeats: int = 50,
+    batch_size: int = 10000,
+    parallel: bool = False,
+) -> Dict[str, Any]:
+    """
+    Runs benchmarks on multiple ANN libraries using synthetic datasets.
+    Each library runs in its own subprocess (see run_isolated).
+    Args:
+        dataset (str): Dataset size category - small, medium or large.
+        repeats (int): Number of queries to search, raised to at least
+            MIN_SEARCH_SHARDS shards of SEARCH_SHARD queries.
+        batch_size (int): Number of rows to process at a time to reduce memory usage.
+        parallel (bool): Run the library subprocesses concurrently. Cuts wall
+            time, but they then compete for cores and memory bandwidth, so
+            timings are only comparable between runs made the same way.
+    Returns:
+        Dict[str, Any]: Benchmark results including memory usage and timing stats.
+    """
+    config = DATASETS[dataset]
+    N, D, k = config["N"], config["D"], config["k"]
+
+    # Generate float32 directly (C-contiguous) instead of casting from float64
+    rng = np.random.default_rng(int(os.getenv("BENCH_SEED", "0")))
+    data = alloc_random(rng, (N, D))
+    ids = np.ascontiguousarray(np.arange(N, dtype=np.int64))
+    n_queries = max(repeats, SEARCH_SHARD * MIN_SEARCH_SHARDS)
+    queries = alloc_random(rng, (n_queries, D))
+
+    results = {
+        "timestamp": time.time(),
+        "dataset": dataset,
+        "config": config,
+        "repeats": repeats,
+        "n_queries": n_queries,
+        **{name: {} for name in BENCHMARKS},
+    }
+
+    # Hand the inputs to the workers through files, in RAM when /dev/shm exists
+    # and has room for them; otherwise fall back to the default temp dir
+    shm = None
+    if os.path.isdir("/dev/shm"):
+        needed = data.nbytes + ids.nbytes + queries.nbytes
+        if shutil.disk_usage("/dev/shm").free > needed:
+            shm = "/dev/shm"
+    with tempfile.TemporaryDirectory(dir=shm) as tmp:
+        paths = tuple(os.path.join(tmp, f"{name}.npy") for name in ("data", "ids", "queries"))
+        for path, arr in zip(paths, (data, ids, queries)):
+            np.save(path, arr)
+        # The parent no longer needs its copy of the dataset
+        del data
+
+        if not parallel:
+            # One library at a time, so a failure stops the run immediately
+            for name, fn in BENCHMARKS.items():
+                results[name] = run_isolated(fn, paths, k, batch_size)
+        else:
+            with ThreadPoolExecutor(max_workers=len(BENCHMARKS)) as pool:
+                futures = {
+                    name: pool.submit(run_isolated, fn, paths, k, batch_size)
+                    for name, fn in BENCHMARKS.items()
+                }
+                try:
+                    for name, future in futures.items():
+                        results[name] = future.result()
+                except BaseException:
+                    # Fail fast: drop libraries that have not started yet
+                    pool.shutdown(cancel_futures=True)
+                    raise
 
     return results
 
@@ -182,14 +396,50 @@ if __name__ == "__main__":
     )
     parser.add_argument("--repeats", type=int, default=50)
     parser.add_argument("--batch-size", type=int, default=10000)
-    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="Result file; a .jsonl path gets the run appended as one line",
+    )
+    parser.add_argument("--commit", type=str, help="Commit hash to record with the run")
+    parser.add_argument(
+        "--save-raw",
+        action="store_true",
+        help="Also save rust_annie per-shard latencies next to the output as "
+        "<stem>_<dataset>_<commit or timestamp>_raw.npy",
+    )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Benchmark the libraries concurrently (faster, noisier timings)",
+    )
+    parser.add_argument(
+        "--pin-cpu", action="store_true", help="Pin the benchmark to a single core"
+    )
     args = parser.parse_args()
 
-    results = benchmark(args.dataset, args.repeats, args.batch_size)
+    stabilize_process(args.pin_cpu)
+    results = benchmark(args.dataset, args.repeats, args.batch_size, args.parallel)
+    if args.commit:
+        results["commit"] = args.commit
+    # The percentiles summarize the distribution; keep the raw samples out of
+    # the JSON that the dashboard and regression check parse on every run
+    search_times = results["rust_annie"].pop("search_times", None)
     print(json.dumps(results, indent=2))
 
     out_dir = os.path.dirname(args.output)
     if out_dir:
         os.makedirs(out_dir, exist_ok=True)
-    with open(args.output, "w") as f:
-        json.dump(results, f)
+    if args.save_raw and search_times is not None:
+        # One file per run so appended .jsonl histories keep every run's samples
+        stem = os.path.splitext(args.output)[0]
+        tag = args.commit or int(results["timestamp"])
+        np.save(f"{stem}_{args.dataset}_{tag}_raw.npy", np.asarray(search_times))
+    payload = orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY)
+    if args.output.endswith(".jsonl"):
+        with open(args.output, "ab") as f:
+            f.write(payload + b"\n")
+    else:
+        with open(args.output, "wb") as f:
+            f.write(payload)
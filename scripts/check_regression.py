@@ -1,27 +1,35 @@
-import json, glob
+import glob, os
+import orjson
 
 THRESHOLD = 0.25  # 25% performance regression
+BENCHMARK_LOG = "benchmarks/benchmarks.jsonl"
+
+
+def load_runs():
+    # Legacy one-file-per-run results plus runs appended to benchmarks.jsonl
+    runs = []
+    for f in glob.glob("benchmarks/*.json"):
+        with open(f, "rb") as fp:
+            data = orjson.loads(fp.read())
+        runs.append((data.get("timestamp", 0), (f, 0), data))
+    if os.path.exists(BENCHMARK_LOG):
+        with open(BENCHMARK_LOG, "rb") as fp:
+            for lineno, line in enumerate(fp):
+                if line.strip():
+                    data = orjson.loads(line)
+                    runs.append((data.get("timestamp", 0), (BENCHMARK_LOG, lineno), data))
+    return runs
 
 
 def check_regression():
-    files = glob.glob("benchmarks/*.json")
-    if len(files) < 2:
+    runs = load_runs()
+    if len(runs) < 2:
         return
 
-    # Sort by timestamp
-    file_timestamps = []
-    for f in files:
-        with open(f) as fp:
-            ts = json.load(fp).get("timestamp", 0)
-        file_timestamps.append((ts, f))
-    file_timestamps.sort()
-    files = [f for _, f in file_timestamps]
-    current_file = files[-1]
-    baseline_file = files[-2]
-    with open(current_file) as f:
-        current_data = json.load(f)
-    with open(baseline_file) as f:
-        baseline_data = json.load(f)
+    # Sort by timestamp; each file or line was parsed exactly once
+    runs.sort(key=lambda run: run[:2])
+    baseline_data = runs[-2][2]
+    current_data = runs[-1][2]
 
     dataset = current_data.get("dataset", "unknown")
     regressions = []
@@ -1,58 +1,111 @@
-import os, json, textwrap
-from datetime import datetime
+import os, textwrap
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 import pandas as pd
 import plotly.graph_objects as go
-from jinja2 import Template
 
 BENCHMARK_DIR = "benchmarks"
+BENCHMARK_LOG = "benchmarks.jsonl"
 OUTPUT_HTML = "docs/index.html"
 BADGE_SVG = "docs/dashboard-badge.svg"
 
 
+def _parse_benchmark(path):
+    with open(path, "rb") as f:
+        try:
+            data = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            return None
+    if "timestamp" not in data:
+        return None
+    return data
+
+
 def load_benchmarks(directory=BENCHMARK_DIR):
-    rows = []
-    for fname in sorted(os.listdir(directory)):
-        if not fname.endswith(".json"):
+    paths = [
+        os.path.join(directory, fname)
+        for fname in sorted(os.listdir(directory))
+        if fname.endswith(".json")
+    ]
+    # Overlap file I/O across runs; map() keeps the sorted order
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        rows = [data for data in pool.map(_parse_benchmark, paths) if data is not None]
+    df = pd.DataFrame(rows)
+
+    # Runs appended by `benchmark.py --output benchmarks/benchmarks.jsonl`
+    # load in a single C-level pass
+    log = os.path.join(directory, BENCHMARK_LOG)
+    if os.path.exists(log) and os.path.getsize(log) > 0:
+        runs = pd.read_json(log, lines=True, convert_dates=False, dtype=False)
+        runs = runs.dropna(subset=["timestamp"])
+        df = pd.concat([df, runs], ignore_index=True)
+
+    if df.empty:
+        return df
+    # One vectorized conversion for the whole column instead of one
+    # datetime per run
+    df["date"] = pd.to_datetime(df["timestamp"], unit="s", utc=True)
+    df["commit"] = df["commit"].fillna("unknown") if "commit" in df else "unknown"
+    return df
+
+
+LIBRARIES = ["rust_annie", "sklearn", "faiss", "annoy"]
+METRICS = [
+    "build_memory_mb",
+    "build_time",
+    "search_avg",
+    "search_p50",
+    "search_p95",
+    "search_p99",
+]
+
+
+def extract_metrics(df):
+    # Unpack the per-library result dicts once into a long frame with one row
+    # per (run, lib, metric) so every figure is a single groupby over it
+    value_vars = {}
+    df = df.copy()
+    for lib in LIBRARIES:
+        if lib not in df.columns:
             continue
-        path = os.path.join(directory, fname)
-        with open(path) as f:
-            try:
-                data = json.load(f)
-                if "timestamp" not in data:
-                    continue
-                data["commit"] = data.get("commit", "unknown")
-                data["date"] = datetime.utcfromtimestamp(data["timestamp"])
-                rows.append(data)
-            except json.JSONDecodeError:
-                continue
-    return pd.DataFrame(rows)
-
-
-def create_scatter_plot(df, metric_name, title, yaxis_title, transform=None):
+        for metric in METRICS:
+            col = f"{lib}_{metric}"
+            df[col] = df[lib].map(
+                lambda x: x.get(metric, 0) if isinstance(x, dict) else None
+            )
+            value_vars[col] = (lib, metric)
+
+    long = df.melt(
+        id_vars=["date", "dataset"],
+        value_vars=list(value_vars),
+        var_name="lib_metric",
+        value_name="value",
+    ).dropna(subset=["value"])
+    lib_metric = long.pop("lib_metric").map(value_vars)
+    # Categorical keeps the legend in LIBRARIES order rather than alphabetical
+    long["lib"] = pd.Categorical(lib_metric.str[0], categories=LIBRARIES)
+    long["metric"] = lib_metric.str[1]
+    long["value"] = long["value"].astype(float)
+    return long
+
+
+def create_scatter_plot(long, metric_name, title, yaxis_title, transform=None):
     fig = go.Figure()
-    libraries = ["rust_annie", "sklearn", "faiss", "annoy"]
 
-    for lib in libraries:
-        lib_df = df[df[lib].notnull()].copy()
-        if lib_df.empty:
-            continue
+    # Determine metric key
+    key = "build_memory_mb" if "memory" in metric_name.lower() else "search_avg"
+    rows = long[long["metric"] == key]
 
-        # Determine metric key
-        key = "build_memory_mb" if "memory" in metric_name.lower() else "search_avg"
-        # Extract values, applying transform if provided
-        lib_df["metric_value"] = lib_df[lib].apply(
-            lambda x: transform(x.get(key, 0)) if transform else x.get(key, 0)
-        )
-
-        for dataset, group in lib_df.groupby("dataset"):
-            fig.add_trace(
-                go.Scatter(
-                    x=group["date"],
-                    y=group["metric_value"],
-                    mode="lines+markers",
-                    name=f"{lib} ({dataset})",
-                )
+    for (lib, dataset), group in rows.groupby(["lib", "dataset"], observed=True):
+        values = group["value"]
+        fig.add_trace(
+            go.Scatter(
+                x=group["date"],
+                y=transform(values) if transform else values,
+                mode="lines+markers",
+                name=f"{lib} ({dataset})",
             )
+        )
 
     fig.update_layout(
         title=title,
@@ -63,25 +116,22 @@ def create_scatter_plot(df, metric_name, title, yaxis_title, transform=None):
     return fig
 
 
-def create_bar_plot(df, metric_name, title, yaxis_title):
+def create_bar_plot(long, metric_name, title, yaxis_title):
     fig = go.Figure()
-    libraries = ["rust_annie", "sklearn", "faiss", "annoy"]
+    means = (
+        long[long["metric"] == metric_name]
+        .groupby(["lib", "dataset"], observed=True)["value"]
+        .mean()
+    )
 
-    for lib in libraries:
-        lib_df = df[df[lib].notnull()].copy()
-        if lib_df.empty:
-            continue
-        # Compute build_time for each entry
-        lib_df["build_time_val"] = lib_df[lib].apply(lambda x: x.get(metric_name, 0))
-
-        for dataset, group in lib_df.groupby("dataset"):
-            fig.add_trace(
-                go.Bar(
-                    x=[dataset],
-                    y=[group["build_time_val"].mean()],
-                    name=f"{lib} ({dataset})",
-                )
+    for (lib, dataset), mean in means.items():
+        fig.add_trace(
+            go.Bar(
+                x=[dataset],
+                y=[mean],
+                name=f"{lib} ({dataset})",
             )
+        )
 
     fig.update_layout(
         title=title, xaxis_title="Dataset", yaxis_title=yaxis_title, barmode="group"
@@ -89,33 +139,20 @@ def create_bar_plot(df, metric_name, title, yaxis_title):
     return fig
 
 
-def create_percentile_plot(df):
+def create_percentile_plot(long):
     fig = go.Figure()
-    rust_df = df[df["rust_annie"].notnull()].copy()
+    rows = long[
+        (long["lib"] == "rust_annie")
+        & long["metric"].isin(["search_p50", "search_p95", "search_p99"])
+    ]
 
-    for dataset, group in rust_df.groupby("dataset"):
-        fig.add_trace(
-            go.Scatter(
-                x=group["date"],
-                y=group["rust_annie"].apply(lambda x: x.get("search_p50", 0) * 1000),
-                mode="lines+markers",
-                name=f"P50 ({dataset})",
-            )
-        )
-        fig.add_trace(
-            go.Scatter(
-                x=group["date"],
-                y=group["rust_annie"].apply(lambda x: x.get("search_p95", 0) * 1000),
-                mode="lines+markers",
-                name=f"P95 ({dataset})",
-            )
-        )
+    for (dataset, metric), group in rows.groupby(["dataset", "metric"]):
         fig.add_trace(
             go.Scatter(
                 x=group["date"],
-                y=group["rust_annie"].apply(lambda x: x.get("search_p99", 0) * 1000),
+                y=group["value"] * 1000,
                 mode="lines+markers",
-                name=f"P99 ({dataset})",
+                name=f"{metric.rsplit('_', 1)[1].upper()} ({dataset})",
             )
         )
 
@@ -129,63 +166,76 @@ def create_percentile_plot(df):
 
 
 def create_dashboard(df):
+    long = extract_metrics(df)
+
     mem_fig = create_scatter_plot(
-        df, "Memory Usage", "Index Build Memory Usage", "Memory (MB)"
+        long, "Memory Usage", "Index Build Memory Usage", "Memory (MB)"
     )
 
     latency_fig = create_scatter_plot(
-        df,
+        long,
         "Search Latency",
         "Search Latency (Average)",
         "Time (ms)",
         transform=lambda x: x * 1000,  # Convert seconds to milliseconds
     )
 
-    pct_fig = create_percentile_plot(df)
+    pct_fig = create_percentile_plot(long)
 
     build_fig = create_bar_plot(
-        df, "build_time", "Index Build Time Comparison", "Time (seconds)"
+        long, "build_time", "Index Build Time Comparison", "Time (seconds)"
     )
 
     return mem_fig, latency_fig, pct_fig, build_fig
 
 
+def _figure_json(fig):
+    # Embedded in a <script> block, so a literal "</" must not end it early
+    return fig.to_json().replace("</", "<\\/")
+
+
 def write_html(figs, output=OUTPUT_HTML):
     mem_fig, latency_fig, pct_fig, build_fig = figs
 
-    template = Template(
-        textwrap.dedent(
-            """
+    latency_json = _figure_json(latency_fig)
+    memory_json = _figure_json(mem_fig)
+    pct_json = _figure_json(pct_fig)
+    build_json = _figure_json(build_fig)
+
+    html = textwrap.dedent(
+        f"""
     <!DOCTYPE html>
     <html>
     <head>
         <title>ANN Benchmark Dashboard</title>
         <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
         <style>
-            .dashboard { display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }
-            .plot { height: 500px; }
-            .full-width { grid-column: 1 / -1; }
+            .dashboard {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }}
+            .plot {{ height: 500px; }}
+            .full-width {{ grid-column: 1 / -1; }}
         </style>
     </head>
     <body>
         <h1>ANN Performance Dashboard</h1>
         <div class="dashboard">
-            <div class="plot">{{ latency_plot }}</div>
-            <div class="plot">{{ memory_plot }}</div>
-            <div class="plot">{{ pct_plot }}</div>
-            <div class="plot full-width">{{ build_plot }}</div>
+            <div class="plot" id="latency"></div>
+            <div class="plot" id="memory"></div>
+            <div class="plot" id="pct"></div>
+            <div class="plot full-width" id="build"></div>
         </div>
+        <script id="latency_data" type="application/json">{latency_json}</script>
+        <script id="memory_data" type="application/json">{memory_json}</script>
+        <script id="pct_data" type="application/json">{pct_json}</script>
+        <script id="build_data" type="application/json">{build_json}</script>
+        <script>
+            for (const id of ["latency", "memory", "pct", "build"]) {{
+                const fig = JSON.parse(document.getElementById(id + "_data").textContent);
+                Plotly.newPlot(id, fig.data, fig.layout, {{responsive: true}});
+            }}
+        </script>
     </body>
     </html>
     """
-        )
-    )
-
-    html = template.render(
-        latency_plot=latency_fig.to_html(full_html=False, include_plotlyjs=False),
-        memory_plot=mem_fig.to_html(full_html=False, include_plotlyjs=False),
-        pct_plot=pct_fig.to_html(full_html=False, include_plotlyjs=False),
-        build_plot=build_fig.to_html(full_html=False, include_plotlyjs=False),
     )
 
     os.makedirs(os.path.dirname(output), exist_ok=True)
@@ -208,36 +258,32 @@ def write_badge(df, output=BADGE_SVG):
     except (TypeError, KeyError):
         return
 
-    badge_template = Template(
-        textwrap.dedent(
-            """
+    if speedup > 1.2:
+        color, value = "#4c1", f"{speedup:.1f}x"
+    elif speedup > 0.8:
+        color, value = "#dfb317", f"{speedup:.1f}x"
+    else:
+        color, value = "#e05d44", f"{speedup:.1f}x"
+
+    svg = textwrap.dedent(
+        f"""
     <svg xmlns="http://www.w3.org/2000/svg" width="180" height="20">
         <linearGradient id="b" x2="0" y2="100%">
             <stop offset="0" stop-color="#bbb" stop-opacity=".1"/>
             <stop offset="1" stop-opacity=".1"/>
         </linearGradient>
         <rect width="180" height="20" fill="#555"/>
-        <rect x="120" width="60" height="20" fill="{{ color }}"/>
+        <rect x="120" width="60" height="20" fill="{color}"/>
         <rect width="180" height="20" fill="url(#b)"/>
         <g fill="#fff" text-anchor="middle" font-family="DejaVu Sans,Verdana,Geneva,sans-serif" font-size="11">
             <text x="60" y="15" fill="#010101" fill-opacity=".3">Performance</text>
             <text x="60" y="14">Performance</text>
-            <text x="150" y="15" fill="#010101" fill-opacity=".3">{{ value }}</text>
-            <text x="150" y="14">{{ value }}</text>
+            <text x="150" y="15" fill="#010101" fill-opacity=".3">{value}</text>
+            <text x="150" y="14">{value}</text>
         </g>
     </svg>
     """
-        )
     )
-
-    if speedup > 1.2:
-        color, value = "#4c1", f"{speedup:.1f}x"
-    elif speedup > 0.8:
-        color, value = "#dfb317", f"{speedup:.1f}x"
-    else:
-        color, value = "#e05d44", f"{speedup:.1f}x"
-
-    svg = badge_template.render(color=color, value=value)
     with open(output, "w") as f:
         f.write(svg)
     print(f"Badge saved to {output}")
@@ -4,29 +4,38 @@ import pytest
 import os
 
 
-def test_hnsw_basic():
-    dim = 64
+def _check_hnsw_search(n, dim=64, k=10):
+    rng = np.random.default_rng(0)
     index = PyHnswIndex(dims=dim)
 
     # Generate sample data
-    data = np.random.rand(1000, dim).astype(np.float32)
-    ids = np.arange(1000, dtype=np.int64)
+    data = rng.random((n, dim), dtype=np.float32)
+    ids = np.arange(n, dtype=np.int64)
 
     # Add to index
     index.add(data, ids)
 
     # Generate a random query
-    query = np.random.rand(dim).astype(np.float32)
+    query = rng.random(dim, dtype=np.float32)
 
     # Search
-    retrieved_ids = index.search(query, k=10)
+    retrieved_ids = index.search(query, k=k)
 
     # Assertions
     retrieved_ids = np.array(retrieved_ids)
-    assert retrieved_ids.shape == (10,)
+    assert retrieved_ids.shape == (k,)
     assert issubclass(retrieved_ids.dtype.type, np.integer)
 
 
+def test_hnsw_basic():
+    _check_hnsw_search(128)
+
+
+@pytest.mark.slow
+def test_hnsw_1000_vectors():
+    _check_hnsw_search(1000)
+
+
 # Deprecated test since PyHnswConfig no longer exists
 # def test_invalid_config():
 #     config = PyHnswConfig(m=0, ef_construction=10, ef_search=0, max_elements=0)